@@ -0,0 +1,12 @@
+# SPDX-FileCopyrightText: 2023 Susumu OTA <1632335+susumuota@users.noreply.github.com>
+#
+# SPDX-License-Identifier: MIT
+
+import re
+
+# arXiv categories like cs.CL. this drops ACM/MSC classes like I.2.7 or 68T50
+CATEGORY_PATTERN = re.compile(r'\w+\.\w+\Z')
+
+def join_categories(primary_category, categories):
+  """primary category first, then the other arXiv categories"""
+  return ' | '.join([primary_category] + [c for c in categories if c != primary_category and CATEGORY_PATTERN.match(c)])
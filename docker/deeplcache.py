@@ -3,37 +3,52 @@
 # SPDX-License-Identifier: MIT
 
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import gzip
-import json
+from itertools import chain
 import os
 import tempfile
 
+import msgpack
+import orjson
+import zstandard
+
+# caches are small, so default chunk size of blob.open (40MB) is too large. main.py uses this too
+GCS_CHUNK_SIZE = 256 * 1024
+
 class DeepLCache:
   def __init__(self, translator):
     self.translator = translator
-    self.cache = {}
+    self.cache = OrderedDict() # least recently used first
 
-  def clear_cache(self, expire_timedelta=None):
-    if expire_timedelta is None:
-      self.cache = {}
+  def clear_cache(self, expire_timedelta=None, max_entries=None):
+    if expire_timedelta is None and max_entries is None:
+      self.cache = OrderedDict()
       return
-    expire_dt = datetime.datetime.now(datetime.timezone.utc) - expire_timedelta
-    def is_not_expire(item):
-      # item is [arxiv_id, [texts, ts]]
-      return datetime.datetime.fromisoformat(item[1][1]) > expire_dt
-    self.cache = dict(filter(is_not_expire, self.cache.items()))  # type: ignore
+    if expire_timedelta is not None:
+      expire_dt = datetime.datetime.now(datetime.timezone.utc) - expire_timedelta
+      def is_not_expire(item):
+        # item is [arxiv_id, [texts, ts]]
+        return datetime.datetime.fromisoformat(item[1][1]) > expire_dt
+      self.cache = OrderedDict(filter(is_not_expire, self.cache.items()))  # type: ignore
+    if max_entries is not None:
+      while len(self.cache) > max_entries:
+        self.cache.popitem(last=False)
 
   def __repr__(self):
     return repr(self.cache) # TODO
 
   def load(self, filename):
-    with gzip.open(filename, 'rt', encoding='UTF-8') as f:
-      self.cache = json.load(f)
+    with gzip.open(filename, 'rb') as f:
+      self.cache = OrderedDict(orjson.loads(f.read()))
 
   def save(self, filename):
-    with gzip.open(filename, 'wt', encoding='UTF-8') as f:
-      json.dump(self.cache, f)
+    with gzip.open(filename, 'wb', compresslevel=1) as f:
+      # orjson reads the underlying dict storage, which move_to_end does not reorder.
+      # copy to a plain dict so that the LRU order is saved.
+      f.write(orjson.dumps(dict(self.cache)))
 
   def load_from_s3(self, s3_bucket, filename):
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -48,19 +63,33 @@ class DeepLCache:
       s3_bucket.upload_file(filename, tmpfilename)
 
   def load_from_gcs(self, gcs_bucket, filename):
-    with tempfile.TemporaryDirectory() as tmpdir:
-      tmpfilename = os.path.join(tmpdir, filename)
-      gcs_bucket.blob(filename).download_to_filename(tmpfilename)
-      self.load(tmpfilename)
+    with gcs_bucket.blob(filename).open('rb', chunk_size=GCS_CHUNK_SIZE) as f:
+      self.load(f)
 
   def save_to_gcs(self, gcs_bucket, filename):
-    with tempfile.TemporaryDirectory() as tmpdir:
-      tmpfilename = os.path.join(tmpdir, filename)
-      self.save(tmpfilename)
-      gcs_bucket.blob(filename).upload_from_filename(tmpfilename)
+    with gcs_bucket.blob(filename).open('wb', chunk_size=GCS_CHUNK_SIZE, ignore_flush=True) as f:
+      self.save(f)
+
+  def load_from_gcs_msgpack(self, gcs_bucket, filename):
+    with gcs_bucket.blob(filename).open('rb', chunk_size=GCS_CHUNK_SIZE) as f:
+      self.cache = OrderedDict(msgpack.unpackb(zstandard.ZstdDecompressor().decompress(f.read())))
+
+  def save_to_gcs_msgpack(self, gcs_bucket, filename):
+    with gcs_bucket.blob(filename).open('wb', chunk_size=GCS_CHUNK_SIZE, ignore_flush=True) as f:
+      f.write(zstandard.ZstdCompressor(level=3).compress(msgpack.packb(self.cache)))
 
   def get(self, key, default=None):
-    return self.cache.get(key, default)
+    if key not in self.cache:
+      return default
+    self.cache.move_to_end(key)
+    return self.cache[key]
+
+  def is_new(self, keys, threshold):
+    """whether each key was translated after threshold. unlike get(), this does not change the LRU order"""
+    def trans_dt(key):
+      trans = self.cache.get(key) # OrderedDict.get does not move the key
+      return datetime.datetime.fromisoformat(trans[1]) if trans is not None else None
+    return [dt is not None and dt > threshold for dt in map(trans_dt, keys)]
 
   def translate_text(self, text, target_lang, key):
     trans = self.get(key, None)
@@ -72,3 +101,32 @@ class DeepLCache:
     trans = [trans_texts, trans_ts]
     self.cache[key] = trans
     return trans
+
+  def translate_texts(self, items, target_lang, max_texts=50, max_bytes=100*1024, max_workers=4):
+    # items is [[key, texts], ...]. translate uncached items in as few requests as possible.
+    # a request can have up to 50 texts and 128KiB body.
+    # https://www.deepl.com/docs-api/translate-text/translate-text/
+    jobs = {key: texts for key, texts in items if self.get(key) is None}
+    # the same sentence is translated only once
+    unique_texts = list(dict.fromkeys([t for texts in jobs.values() for t in texts]))
+    batches = []
+    batch = []
+    size = 0
+    for text in unique_texts:
+      text_size = len(text.encode('utf-8'))
+      if len(batch) >= max_texts or (batch and size + text_size > max_bytes):
+        batches.append(batch)
+        batch = []
+        size = 0
+      batch.append(text)
+      size += text_size
+    if batch:
+      batches.append(batch)
+    def translate(batch):
+      return [r.text for r in self.translator.translate_text(text=batch, target_lang=target_lang)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      translations = dict(zip(unique_texts, chain.from_iterable(executor.map(translate, batches))))
+    trans_ts = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    for key, texts in jobs.items():
+      self.cache[key] = [[translations[t] for t in texts], trans_ts]
+    return [self.get(key) for key, _ in items]
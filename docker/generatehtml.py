@@ -4,9 +4,10 @@
 
 from datetime import datetime, timedelta, timezone
 from itertools import zip_longest
-import re
 
-import dateutil.parser
+import pandas as pd
+
+from categories import join_categories
 
 
 HTML_TRANS_TEMPLATE = '''
@@ -41,7 +42,8 @@ HTML_TRANS_TEMPLATE = '''
 </html>
 '''
 
-HTML_TRANS_ITEM_TEMPLATE = '''
+def html_trans_item(translation, source):
+  return f'''
 <p class="item">
   <span class="translation">
     {translation}
@@ -54,9 +56,7 @@ HTML_TRANS_ITEM_TEMPLATE = '''
 '''
 
 def generate_trans_html(title, authors, url, trans_texts, summary_texts):
-  items = map(
-    lambda item: HTML_TRANS_ITEM_TEMPLATE.format(translation=item[0], source=item[1]),
-    zip_longest(trans_texts, summary_texts, fillvalue=''))
+  items = [html_trans_item(t, s) for t, s in zip_longest(trans_texts, summary_texts, fillvalue='')]
   return HTML_TRANS_TEMPLATE.format(title=title, authors=authors, url=url, content='\n'.join(items))
 
 HTML_TOP_N_TEMPLATE = '''
@@ -82,7 +82,8 @@ HTML_TOP_N_TEMPLATE = '''
 </html>
 '''
 
-HTML_TOP_N_ITEM_TEMPLATE = '''
+def html_top_n_item(i, n, new_icon, title, stats, categories, updated, arxiv_id):
+  return f'''
 <p class="item">
   [{i}/{n}] {new_icon}<b>{title}</b><br />
   <it>{stats}, {categories}, {updated}</it><br />
@@ -91,14 +92,15 @@ HTML_TOP_N_ITEM_TEMPLATE = '''
 '''
 
 def generate_top_n_html(page_title, date, df, dlc):
-  df = df[::-1]  # normal order (reversed reversed order)
   items = []
   twenty_three_hours_ago = datetime.now(timezone.utc) - timedelta(hours=23)
-  for i, (arxiv_id, updated, title, summary, authors, comment, primary_category, categories, like_count, retweet_count, quote_count, replay_count, tweet_count) in enumerate(zip(df['arxiv_id'], df['updated'], df['title'], df['summary'], df['authors'], df['comment'], df['primary_category'], df['categories'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count'], df['tweet_count'])):
-    trans_texts, trans_ts = dlc.get(arxiv_id, None)
-    new_icon = '<b>[New]</b> ' if twenty_three_hours_ago < datetime.fromisoformat(trans_ts) else '' # TODO
-    categories = ' | '.join([c for c in [primary_category] + [c for c in categories if c != primary_category and re.match(r'\w+\.\w+$', c)]])
+  is_news = pd.Series(dlc.is_new(df['arxiv_id'], twenty_three_hours_ago), index=df.index)
+  updated_mds = pd.to_datetime(df['updated'], utc=True).dt.strftime('%d %b %Y')
+  columns = [c.to_numpy() for c in [df['arxiv_id'], updated_mds, df['title'], df['summary'], df['authors'], df['comment'], df['primary_category'], df['categories'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count'], df['tweet_count'], is_news]]
+  for i in range(len(df)):
+    arxiv_id, updated_md, title, summary, authors, comment, primary_category, categories, like_count, retweet_count, quote_count, replay_count, tweet_count, is_new = [c[i] for c in columns]
+    new_icon = '<b>[New]</b> ' if is_new else ''
+    categories = join_categories(primary_category, categories)
     stats = f'<b>{like_count}</b> Likes, {retweet_count} Retweets, {quote_count} Quotes, {replay_count} Replies, {tweet_count} Tweets'
-    updated = dateutil.parser.isoparse(updated).strftime('%d %b %Y')
-    items.append(HTML_TOP_N_ITEM_TEMPLATE.format(i=i+1, n=len(df), new_icon=new_icon, title=title, stats=stats, categories=categories, updated=updated, arxiv_id=arxiv_id))
+    items.append(html_top_n_item(i+1, len(df), new_icon, title, stats, categories, updated_md, arxiv_id))
   return HTML_TOP_N_TEMPLATE.format(title=page_title, date=date, content='\n'.join(items))
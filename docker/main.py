@@ -2,39 +2,40 @@
 #
 # SPDX-License-Identifier: MIT
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache, reduce
 import gzip
-import json
 import os
 import re
 from shlex import quote
 import subprocess
 import tempfile
-import time
 import unicodedata
 
+import orjson
 import pandas as pd
-import dateutil.parser
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 import tweepy
 import arxiv
+import httpx
 import deepl
 import pysbd
 from slack_sdk import WebClient
 import imgkit
 
 import deeplcache
+from ratelimiter import RateLimiter
+from categories import join_categories
 from generatehtml import generate_trans_html, generate_top_n_html
 
 
 def load_from_gcs(gcs_bucket, filename):
   blb = gcs_bucket.get_blob(filename)
   if blb and blb.exists():
-    with tempfile.TemporaryDirectory() as tmpdir:
-      tmpfilename = os.path.join(tmpdir, filename)
-      blb.download_to_filename(tmpfilename)
-      with gzip.open(tmpfilename, 'rt', encoding='UTF-8') as f:
-        return json.load(f)
+    with blb.open('rb', chunk_size=deeplcache.GCS_CHUNK_SIZE) as f, gzip.open(f, 'rb') as gz:
+      return orjson.loads(gz.read())
   return None
 
 def load_from_gcs_with_expired(gcs_bucket, filename, expire_timedelta=None):
@@ -47,55 +48,57 @@ def load_from_gcs_with_expired(gcs_bucket, filename, expire_timedelta=None):
   return None
 
 def save_to_gcs(gcs_bucket, filename, obj):
-  with tempfile.TemporaryDirectory() as tmpdir:
-    tmpfilename = os.path.join(tmpdir, filename)
-    with gzip.open(tmpfilename, 'wt', encoding='UTF-8') as f:
-      json.dump(obj, f)
-    gcs_bucket.blob(filename).upload_from_filename(tmpfilename)
+  with gcs_bucket.blob(filename).open('wb', chunk_size=deeplcache.GCS_CHUNK_SIZE, ignore_flush=True) as f, gzip.open(f, 'wb', compresslevel=1) as gz:
+    gz.write(orjson.dumps(obj))
 
 def search_recent_tweets(api, query, since_id=None, page_limit=1):
   """https://docs.tweepy.org/en/stable/client.html#tweepy.Client.search_recent_tweets"""
-  def get_unique_list(seq):
-    seen = []
-    return [x for x in seq if x not in seen and not seen.append(x)]
   max_results = 100
   expansions = ['author_id'] # this makes response.includes['users']
   tweet_fields = ['author_id', 'created_at', 'lang', 'public_metrics', 'referenced_tweets', 'entities']
-  tweets = []
-  users = []
-  meta = {'newest_id': None, 'oldest_id': None, 'result_count': 0, 'next_token': None}
-  i = 0
+  # each page is converted to DataFrame right away
+  tweets_frames = []
+  users_frames = []
+  metas = []
   for response in tweepy.Paginator(api.search_recent_tweets, query=query, max_results=max_results, since_id=since_id, expansions=expansions, tweet_fields=tweet_fields, limit=page_limit, user_auth=False):
     if response.data:  # type: ignore
-      tweets.extend([t.data for t in response.data])  # type: ignore
+      tweets_frames.append(pd.json_normalize([t.data for t in response.data]))  # type: ignore
     if response.includes and 'users' in response.includes:  # type: ignore
-      users.extend([u.data for u in response.includes['users']])  # type: ignore
-    # merge meta
-    meta['result_count'] += response.meta['result_count']  # type: ignore
-    meta['next_token'] = response.meta['next_token'] if 'next_token' in response.meta else None  # type: ignore
-    meta['newest_id'] = response.meta['newest_id'] if 'newest_id' in response.meta and meta['newest_id'] is None else meta['newest_id']  # type: ignore  # TODO: reversed order
-    meta['oldest_id'] = response.meta['oldest_id'] if 'oldest_id' in response.meta else meta['oldest_id']  # type: ignore  # TODO: reversed order
-    i += 1
-    if i % 10 == 0:
-      print('search_recent_tweets: ', i, meta)
-  return {'data': tweets, 'includes': {'users': get_unique_list(users)}, 'meta': meta}
+      users_frames.append(pd.DataFrame([u.data for u in response.includes['users']]))  # type: ignore
+    metas.append(response.meta)  # type: ignore
+    if len(metas) % 10 == 0:
+      print('search_recent_tweets: ', len(metas), metas[-1])
+  # merge meta. ids are numeric strings, so compare them as int
+  newest_ids = [m['newest_id'] for m in metas if 'newest_id' in m]
+  oldest_ids = [m['oldest_id'] for m in metas if 'oldest_id' in m]
+  meta = {
+    'newest_id': max(newest_ids, key=int, default=None),
+    'oldest_id': min(oldest_ids, key=int, default=None),
+    'result_count': sum(m['result_count'] for m in metas),
+    'next_token': metas[-1].get('next_token') if metas else None,
+  }
+  tweets_df = pd.concat(tweets_frames, ignore_index=True) if tweets_frames else pd.DataFrame()
+  users_df = pd.concat(users_frames, ignore_index=True).drop_duplicates(subset='id', ignore_index=True) if users_frames else pd.DataFrame()
+  return {'data': tweets_df, 'includes': {'users': users_df}, 'meta': meta}
+
+# e.g. public_metrics.like_count -> like_count, entities.urls -> urls
+TWEETS_COLUMN_PREFIX_PATTERN = re.compile(r'^(public_metrics|entities)\.')
 
 def convert_to_dfs(tweets):
-  """parse result of search_recent_tweets result to DataFrame"""
+  """split result of search_recent_tweets into DataFrames"""
   def extract(df, field):
     """extract multiple values field"""
-    results = []
-    if field in df.columns:
-      df[['id', field]].apply(lambda x: [results.append({'id': x[0], field: u}) for u in x[1]] if type(x[1]) is list else None, axis=1)
-    results_df = pd.json_normalize(results)
+    if field not in df.columns:
+      return pd.DataFrame()
+    s = df[['id', field]].dropna(subset=[field]).explode(field).dropna(subset=[field])
+    results_df = pd.json_normalize(s[field].tolist())
     # 'id' must be tweet id
-    results_df = results_df.rename(columns={c: re.sub(f'{field}.', r'', c) if c != f'{field}.id' else c for c in results_df.columns}) # type: ignore
+    results_df = results_df.rename(columns={'id': f'{field}.id'})
+    results_df.insert(0, 'id', s['id'].values)
     return results_df
-  meta_df = pd.json_normalize(tweets['meta'])
-  users_df = pd.json_normalize(tweets['includes']['users'])
-  users_df = users_df.rename(columns={'id': 'author_id'}) # 'id' must be tweet id
-  tweets_df = pd.json_normalize(tweets['data'])
-  tweets_df = tweets_df.rename(columns={c: re.sub(r'public_metrics\.|entities\.', r'', c) for c in tweets_df.columns}) # type: ignore
+  meta_df = pd.DataFrame([tweets['meta']])
+  users_df = tweets['includes']['users'].rename(columns={'id': 'author_id'}) # 'id' must be tweet id
+  tweets_df = tweets['data'].rename(columns=lambda c: TWEETS_COLUMN_PREFIX_PATTERN.sub('', c))
   fields = ['urls', 'hashtags', 'mentions', 'annotations', 'cashtags', 'referenced_tweets']
   results = {'meta': meta_df, 'users': users_df}
   for f in fields:
@@ -105,28 +108,36 @@ def convert_to_dfs(tweets):
   return results
 
 def expand_tweets_text(tweets_df, urls_df):
-  results = []
-  for tweet_id, text in zip(tweets_df['id'], tweets_df['text']):
-    u = urls_df[urls_df['id'] == tweet_id]
-    expanded_text = text
-    for url, expanded_url, display_url in zip(u['url'], u['expanded_url'], u['display_url']):
-      expanded_text = expanded_text.replace(url, f'<{expanded_url}|{display_url}>') # for slack
-    results.append({'id': tweet_id, 'expanded_text': expanded_text})
-  return results
+  """replace t.co urls in tweets text with slack style links"""
+  links = '<' + urls_df['expanded_url'].fillna('') + '|' + urls_df['display_url'].fillna('') + '>' # for slack
+  urls_group = urls_df[['id', 'url']].assign(link=links).groupby('id').agg(list)
+  df = tweets_df[['id', 'text']].join(urls_group, on='id')
+  def expand(text, urls, links):
+    return reduce(lambda t, u: t.replace(u[0], u[1]), zip(urls, links), text) if type(urls) is list else text
+  expanded_texts = [expand(text, urls, links) for text, urls, links in zip(df['text'].to_numpy(), df['url'].to_numpy(), df['link'].to_numpy())]
+  return pd.DataFrame({'id': df['id'].to_numpy(), 'expanded_text': expanded_texts})
 
 # https://arxiv.org/help/arxiv_identifier
-ARXIV_URL_PATTERN = re.compile(r'^https?://arxiv\.org/(abs|pdf)/([0-9]{4}\.[0-9]{4,6})(v[0-9]+)?(\.pdf)?$')
+ARXIV_URL_PATTERN = re.compile(r'^https?://arxiv\.org/(abs|pdf)/([0-9]{4}\.[0-9]{4,6})(v[0-9]+)?(\.pdf)?$', re.ASCII)
 
 def get_arxiv_stats(tweets_df, users_df, urls_df):
-  urls = urls_df[['expanded_url', 'unwound_url']].apply(lambda x: x[1] if x[1] != 0 else x[0], axis=1)
-  arxiv_ids_df = pd.concat([urls_df['id'], urls.str.extract(ARXIV_URL_PATTERN)[1].rename('arxiv_id')], axis=1).dropna().drop_duplicates()
-  arxiv_ids_group = pd.merge(arxiv_ids_df, pd.merge(tweets_df, users_df, on='author_id'), on='id').groupby('arxiv_id')
-  arxiv_ids_sum = arxiv_ids_group.sum(numeric_only=True).reset_index()
-  arxiv_ids_count = arxiv_ids_group['id'].count().reset_index().rename(columns={'id': 'tweet_count'})
-  arxiv_stats_df = pd.concat([arxiv_ids_sum, arxiv_ids_count['tweet_count']], axis=1).sort_values(by=['like_count', 'retweet_count', 'quote_count', 'reply_count', 'tweet_count'], ascending=False)
-  #arxiv_tweets_df = pd.merge(arxiv_ids_df, pd.merge(tweets_df, users_df, on='author_id'), on='id') # fast
-  expanded_text_df = pd.json_normalize(expand_tweets_text(tweets_df, urls_df)) # TODO: too slow
-  arxiv_tweets_df = pd.merge(pd.merge(arxiv_ids_df, pd.merge(tweets_df, users_df, on='author_id'), on='id'), expanded_text_df, on='id')
+  urls = urls_df['unwound_url'].fillna(urls_df['expanded_url']) if 'unwound_url' in urls_df.columns else urls_df['expanded_url']
+  # arrow string kernels skip the python objects. only arxiv urls go through the regex.
+  urls = urls.astype('string[pyarrow]')
+  urls = urls[urls.str.contains('arxiv.org', regex=False, na=False)]
+  arxiv_ids = urls.str.extract(ARXIV_URL_PATTERN, expand=True)[1].astype(object).rename('arxiv_id')
+  arxiv_ids_df = pd.concat([urls_df['id'], arxiv_ids], axis=1).dropna().drop_duplicates()
+  tweets_users_df = tweets_df.join(users_df.set_index('author_id'), on='author_id', how='inner')
+  arxiv_ids_tweets_df = arxiv_ids_df.join(tweets_users_df.set_index('id'), on='id', how='inner')
+  arxiv_stats_df = arxiv_ids_tweets_df.groupby('arxiv_id', sort=False).agg(
+    like_count=('like_count', 'sum'),
+    retweet_count=('retweet_count', 'sum'),
+    quote_count=('quote_count', 'sum'),
+    reply_count=('reply_count', 'sum'),
+    tweet_count=('id', 'count'),
+  ).reset_index().sort_values(by=['like_count', 'retweet_count', 'quote_count', 'reply_count', 'tweet_count'], ascending=False)
+  expanded_text_df = expand_tweets_text(tweets_df, urls_df)
+  arxiv_tweets_df = arxiv_ids_tweets_df.join(expanded_text_df.set_index('id'), on='id', how='inner').reset_index(drop=True)
   return {'arxiv_stats': arxiv_stats_df, 'arxiv_tweets': arxiv_tweets_df}
 
 def arxiv_result_to_dict(r):
@@ -153,103 +164,140 @@ def arxiv_result_to_dict(r):
     'pdf_url': r.pdf_url
   }
 
+# arXiv API asks for one request every 3 seconds over a single connection,
+# so chunks are fetched one by one and the client waits between requests (including retries).
+ARXIV_CLIENT = arxiv.Client(page_size=100, delay_seconds=3.0, num_retries=3)
+
 def get_arxiv_contents(id_list, chunk_size=100):
   rs = []
-  cdr = id_list
-  for i in range(1+len(id_list)//chunk_size):
-    car = cdr[:chunk_size]
-    cdr = cdr[chunk_size:]
-    if len(car) > 0:
-      try:
-        search = arxiv.Search(id_list=car, max_results=len(car))
-        r = list(search.results())
-        rs.extend(r)
-        print('search_arxiv_contents: ', i, len(r), len(rs))
-      except Exception as e:
-        print(e)
+  for i in range(0, len(id_list), chunk_size):
+    car = id_list[i:i+chunk_size]
+    try:
+      prev_len = len(rs)
+      rs.extend(ARXIV_CLIENT.results(arxiv.Search(id_list=car, max_results=len(car))))
+      print('search_arxiv_contents: ', i // chunk_size, len(rs) - prev_len, len(rs))
+    except Exception as e:
+      print(e)
   return [arxiv_result_to_dict(r) for r in rs]
 
+SEGMENTER = pysbd.Segmenter(language='en', clean=False)
+
+@lru_cache(maxsize=4096)
+def segment_summary(summary, max_summary):
+  """split summary into sentences. the same summary is segmented by translate_arxiv, post_to_slack and post_to_twitter"""
+  return tuple(SEGMENTER.segment(summary.replace('\n', ' ')[:max_summary]))
+
 def translate_arxiv(dlc, df, target_lang, max_summary):
-  seg = pysbd.Segmenter(language='en', clean=False)
   print('translate_arxiv: before: ', len(dlc.cache))
   print(dlc.translator.get_usage())
-  for arxiv_id, summary in zip(df['arxiv_id'], df['summary']):
-    summary = summary.replace('\n', ' ')[:max_summary]
-    summary_texts = seg.segment(summary)
-    trans_texts, trans_ts = dlc.translate_text(summary_texts, target_lang, arxiv_id)
+  items = [[arxiv_id, segment_summary(summary, max_summary)] for arxiv_id, summary in zip(df['arxiv_id'].to_numpy(), df['summary'].to_numpy())]
+  for (arxiv_id, summary_texts), (trans_texts, trans_ts) in zip(items, dlc.translate_texts(items, target_lang)):
     print('translate_arxiv: ', arxiv_id, sum([len(s) for s in summary_texts]), sum([len(t) for t in trans_texts]), trans_ts)
   print('translate_arxiv: after: ', len(dlc.cache))
   print(dlc.translator.get_usage())
   return dlc
 
-def post_to_slack(api, channel, df, arxiv_tweets_df, dlc, max_summary):
-  df = df[::-1]  # reverse order
+# post at most 1 message per second
+SLACK_RATE_LIMITER = RateLimiter(1)
+TWITTER_RATE_LIMITER = RateLimiter(1)
+
+def group_top_n_tweets(arxiv_tweets_df, n=5):
+  """group tweets by arxiv_id. each group is sorted by popularity and limited to top n"""
+  sorted_df = arxiv_tweets_df.sort_values(by=['like_count', 'retweet_count', 'quote_count', 'reply_count'], ascending=False)
+  return {k: v.head(n) for k, v in sorted_df.groupby('arxiv_id', sort=False)}
+
+SLACK_ARXIV_SECTION_TEMPLATE = '[{i}/{n}] {new_md}*{title_md}*\n{stats_md}, {categories_md}, {updated_md}\n{first_summary}'
+SLACK_ARXIV_LINKS_TEMPLATE = '*Links*: <https://arxiv.org/abs/{arxiv_id}|abs>, <https://arxiv.org/pdf/{arxiv_id}.pdf|pdf>, <https://twitter.com/search?q=arxiv.org%2Fabs%2F{arxiv_id}%20OR%20arxiv.org%2Fpdf%2F{arxiv_id}.pdf|Tweets>\n\n*Authors*: {authors_md}{comment_md}'
+
+def post_to_slack(api, channel, df, arxiv_tweets_df, dlc, max_summary, posted_ids=None):
+  """posted_ids is a set of arxiv_ids already posted from the same df. newly posted ids are added to it"""
   def strip(s, l):
     return s[:l-3] + '...' if len(s) > l else s
+  if posted_ids is None:
+    posted_ids = set()
+  if df['arxiv_id'].isin(posted_ids).all():
+    print('post_to_slack: already posted')
+    return
   text = f'Top {len(df)} most popular arXiv papers in the last 7 days'
   blocks = [{'type': 'header', 'text': {'type': 'plain_text', 'text': text}}]
+  SLACK_RATE_LIMITER.wait()
   api.chat_postMessage(channel=channel, text=text, blocks=blocks)
-  time.sleep(1)
-  seg = pysbd.Segmenter(language='en', clean=False)
   twenty_three_hours_ago = datetime.now(timezone.utc) - timedelta(hours=23)
-  for i, (arxiv_id, updated, title, summary, authors, comment, primary_category, categories, like_count, retweet_count, quote_count, replay_count, tweet_count) in enumerate(zip(df['arxiv_id'], df['updated'], df['title'], df['summary'], df['authors'], df['comment'], df['primary_category'], df['categories'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count'], df['tweet_count'])):
-    summary = summary.replace('\n', ' ')[:max_summary]
-    summary_texts = seg.segment(summary)
-    first_summary = summary_texts[0][:200] # sometimes pysbd failed to split
+  is_news = pd.Series(dlc.is_new(df['arxiv_id'], twenty_three_hours_ago), index=df.index)
+  popular = (arxiv_tweets_df['like_count'] > 0) & (arxiv_tweets_df[['like_count', 'retweet_count', 'quote_count', 'reply_count']].sum(axis=1) > 4)
+  top_n_tweets_dict = group_top_n_tweets(arxiv_tweets_df[popular], 5)
+  empty_tweets_df = arxiv_tweets_df.head(0)
+  # format everything before posting so that the loop only waits for Slack
+  mds_df = pd.DataFrame({
+    'arxiv_id': df['arxiv_id'],
+    'summary_texts': [segment_summary(summary, max_summary) for summary in df['summary']],
+    'new_md': is_news.map({True: ':new: ', False: ''}),
+    'title_md': df['title'].map(lambda title: strip(title, 200)),
+    'stats_md': '_*' + df['like_count'].astype(str) + '* Likes, ' + df['retweet_count'].astype(str) + ' Retweets, ' + df['quote_count'].astype(str) + ' Quotes, ' + df['reply_count'].astype(str) + ' Replies, ' + df['tweet_count'].astype(str) + ' Tweets_',
+    'categories_md': [avoid_auto_link(join_categories(primary_category, categories)) for primary_category, categories in zip(df['primary_category'], df['categories'])],
+    'updated_md': pd.to_datetime(df['updated'], utc=True).dt.strftime('%d %b %Y'),
+    'authors_md': df['authors'].map(lambda authors: strip(', '.join(authors), 1000)),
+    'comment_md': df['comment'].map(lambda comment: f'\n\n*Comments*: {strip(comment, 1000)}\n\n' if comment else ''),
+  })
+  rows = list(mds_df.itertuples(index=False))
+  for i in range(len(rows)-1, -1, -1):  # reverse order
+    row = rows[i]
+    arxiv_id = row.arxiv_id
+    if arxiv_id in posted_ids:
+      continue
+    first_summary = row.summary_texts[0][:200] # sometimes pysbd failed to split
     translation_md = None
-    is_new = False
     trans = dlc.get(arxiv_id, None)
     if trans is not None:
       trans_texts, trans_ts = trans
       first_summary = trans_texts[0][:200] # sometimes pysbd failed to split
-      is_new = True if twenty_three_hours_ago < datetime.fromisoformat(trans_ts) else False
       # assert len(summary_texts) == len(trans_texts) # this rarely happen
-      if len(summary_texts) != len(trans_texts):
-        print('different texts length', arxiv_id, len(summary_texts), len(trans_texts))
+      if len(row.summary_texts) != len(trans_texts):
+        print('different texts length', arxiv_id, len(row.summary_texts), len(trans_texts))
       translation_md = '\n\n'.join(trans_texts)
       translation_md = strip(translation_md, 3000) # must be less than 3001 characters
-    new_md = f':new: ' if is_new else ''
-    title_md = strip(title, 200)
-    categories_md = avoid_auto_link(' | '.join([c for c in [primary_category] + [c for c in categories if c != primary_category and re.match(r'\w+\.\w+$', c)]]))
-    stats_md = f'_*{like_count}* Likes, {retweet_count} Retweets, {quote_count} Quotes, {replay_count} Replies, {tweet_count} Tweets_'
-    updated_md = dateutil.parser.isoparse(updated).strftime('%d %b %Y')
-    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': f'[{len(df)-i}/{len(df)}] {new_md}*{title_md}*\n{stats_md}, {categories_md}, {updated_md}\n{first_summary}'}}]
-    response = api.chat_postMessage(channel=channel, text=title_md, blocks=blocks)
-    time.sleep(1)
+    text = SLACK_ARXIV_SECTION_TEMPLATE.format(i=i+1, n=len(rows), new_md=row.new_md, title_md=row.title_md, stats_md=row.stats_md, categories_md=row.categories_md, updated_md=row.updated_md, first_summary=first_summary)
+    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': text}}]
+    SLACK_RATE_LIMITER.wait()
+    response = api.chat_postMessage(channel=channel, text=row.title_md, blocks=blocks)
     ts = response['ts']
     if translation_md is not None:
       blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': translation_md}}]
-      response = api.chat_postMessage(channel=channel, text=title_md, blocks=blocks, thread_ts=ts)
-      time.sleep(1)
-    authors_md = strip(', '.join(authors), 1000)
-    comment_md = f'\n\n*Comments*: {strip(comment, 1000)}\n\n' if comment else ''
-    abs_md = f'<https://arxiv.org/abs/{arxiv_id}|abs>'
-    pdf_md = f'<https://arxiv.org/pdf/{arxiv_id}.pdf|pdf>'
-    tweets_md = f'<https://twitter.com/search?q=arxiv.org%2Fabs%2F{arxiv_id}%20OR%20arxiv.org%2Fpdf%2F{arxiv_id}.pdf|Tweets>'
-    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': f'*Links*: {abs_md}, {pdf_md}, {tweets_md}\n\n*Authors*: {authors_md}{comment_md}'}}]
-    response = api.chat_postMessage(channel=channel, text=title_md, blocks=blocks, thread_ts=ts)
-    time.sleep(1)
-    top_n_tweets = arxiv_tweets_df.query(f'arxiv_id == "{arxiv_id}" and like_count > 0 and (like_count + retweet_count + quote_count + reply_count) > 4').sort_values(by=['like_count', 'retweet_count', 'quote_count', 'reply_count'], ascending=False).head(5) # TODO
+      SLACK_RATE_LIMITER.wait()
+      response = api.chat_postMessage(channel=channel, text=row.title_md, blocks=blocks, thread_ts=ts)
+    text = SLACK_ARXIV_LINKS_TEMPLATE.format(arxiv_id=arxiv_id, authors_md=row.authors_md, comment_md=row.comment_md)
+    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': text}}]
+    SLACK_RATE_LIMITER.wait()
+    response = api.chat_postMessage(channel=channel, text=row.title_md, blocks=blocks, thread_ts=ts)
+    top_n_tweets = top_n_tweets_dict.get(arxiv_id, empty_tweets_df)
     post_to_slack_tweets(api, channel, ts, top_n_tweets)
-    print('post_to_slack: ', f'[{len(df)-i}/{len(df)}]')
+    posted_ids.add(arxiv_id)
+    print('post_to_slack: ', f'[{i+1}/{len(rows)}]')
 
 def post_to_slack_tweets(api, channel, ts, df):
-  for i, (tweet_id, expanded_text, created_at, username, name, like_count, retweet_count, quote_count, replay_count) in enumerate(zip(df['id'], df['expanded_text'], df['created_at'], df['username'], df['name'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count'])):
-    blocks = []
-    stats_md = f'_*{like_count}* Likes, {retweet_count} Retweets, {quote_count} Quotes, {replay_count} Replies_'
-    created_at_md = dateutil.parser.isoparse(created_at).strftime('%d %b')
-    url_md = f'<https://twitter.com/{username}/status/{tweet_id}|{created_at_md}>'
-    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': f'({i+1}/{len(df)}) {stats_md}, {url_md}\n'}}]
-    response = api.chat_postMessage(channel=channel, text=url_md, thread_ts=ts, blocks=blocks)
-    time.sleep(1)
+  mds_df = pd.DataFrame({
+    'stats_md': '_*' + df['like_count'].astype(str) + '* Likes, ' + df['retweet_count'].astype(str) + ' Retweets, ' + df['quote_count'].astype(str) + ' Quotes, ' + df['reply_count'].astype(str) + ' Replies_',
+    'url_md': '<https://twitter.com/' + df['username'] + '/status/' + df['id'].astype(str) + '|' + pd.to_datetime(df['created_at'], utc=True).dt.strftime('%d %b') + '>',
+  })
+  messages = []
+  for i, row in enumerate(mds_df.itertuples(index=False)):
+    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': f'({i+1}/{len(mds_df)}) {row.stats_md}, {row.url_md}\n'}}]
+    messages.append((row.url_md, blocks))
+  # replies to the same thread must be posted in order, so only the posting is rate limited
+  for url_md, blocks in messages:
+    SLACK_RATE_LIMITER.wait()
+    api.chat_postMessage(channel=channel, text=url_md, thread_ts=ts, blocks=blocks)
+
+# reuse HTTP/2 connections to arxiv.org across downloads
+HTTP_CLIENT = httpx.Client(http2=True, follow_redirects=True, timeout=60.0)
 
 def download_arxiv_pdf(arxiv_id, tmp_dir):
-  dir = quote(tmp_dir)
-  output = quote(f'{arxiv_id}.pdf')
-  url = quote(f'https://arxiv.org/pdf/{arxiv_id}.pdf')
-  result = subprocess.run(f'aria2c -q -x5 -k1M -d {dir} -o {output} {url}', shell=True)
-  assert result.returncode == 0  # TODO
-  return os.path.join(tmp_dir, f'{arxiv_id}.pdf')
+  filename = os.path.join(tmp_dir, f'{arxiv_id}.pdf')
+  response = HTTP_CLIENT.get(f'https://arxiv.org/pdf/{arxiv_id}.pdf')
+  response.raise_for_status()
+  with open(filename, 'wb') as f:
+    f.write(response.content)
+  return filename
 
 def pdf_to_png(pdf_filename):
   filename = quote(pdf_filename)
@@ -267,6 +315,7 @@ def avoid_auto_link(text):
   https://shkspr.mobi/blog/2015/01/how-to-stop-twitter-auto-linking-urls/"""
   return text.replace('.', '․')
 
+@lru_cache(maxsize=1<<16)
 def get_char_width(c):
   return 2 if unicodedata.east_asian_width(c) in 'FWA' else 1
 
@@ -304,81 +353,95 @@ def upload_html_to_twitter(api_v1, filename, html_text):
   return None
 
 def post_to_twitter(api_v1, api_v2, df, arxiv_tweets_df, dlc, max_summary):
-  df = df[::-1]  # reverse order
   twenty_three_hours_ago = datetime.now(timezone.utc) - timedelta(hours=23)
-  seg = pysbd.Segmenter(language='en', clean=False)
-  for i, (arxiv_id, updated, title, summary, authors, comment, primary_category, categories, like_count, retweet_count, quote_count, replay_count, tweet_count) in enumerate(zip(df['arxiv_id'], df['updated'], df['title'], df['summary'], df['authors'], df['comment'], df['primary_category'], df['categories'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count'], df['tweet_count'])):
-    trans_texts, trans_ts = dlc.get(arxiv_id, None)
-    # only post new papers
-    if not (twenty_three_hours_ago < datetime.fromisoformat(trans_ts)):
-      continue
-    trans_text = ''.join(trans_texts)
-    summary_texts = seg.segment(summary.replace('\n', ' ')[:max_summary])
-    summary_text = ' '.join(summary_texts)
-    new_md = '🆕' if twenty_three_hours_ago < datetime.fromisoformat(trans_ts) else ''
-    authors_md = ', '.join(authors)
-    categories_md = avoid_auto_link(' | '.join([c for c in [primary_category] + [c for c in categories if c != primary_category and re.match(r'\w+\.\w+$', c)]]))
-    stats_md = f'{like_count} Likes, {retweet_count} Retweets, {quote_count} Quotes, {replay_count} Replies, {tweet_count} Tweets'
-    updated_md = dateutil.parser.isoparse(updated).strftime('%d %b %Y')
-    title_md = title
-    abs_md = f'https://arxiv.org/abs/{arxiv_id}'
-    media_ids = []
-    first_page_media_id = upload_first_page_to_twitter(api_v1, arxiv_id)
-    if first_page_media_id:
-      api_v1.create_media_metadata(first_page_media_id, strip_tweet(summary_text, 1000))
-      media_ids.append(first_page_media_id)
-    text = f'[{len(df)-i}/{len(df)}] {stats_md}\n{abs_md} {categories_md}, {updated_md}\n\n{new_md}{title_md}\n\n{authors_md}'
-    prev_tweet_id = None
-    try:
-      response = api_v2.create_tweet(text=strip_tweet(text, 280), user_auth=True, media_ids=media_ids if len(media_ids) > 0 else None)
-      prev_tweet_id = response.data['id']
-    except Exception as e:
-      print(e)
-    time.sleep(1)
-    top_n_tweets = arxiv_tweets_df.query(f'arxiv_id == "{arxiv_id}" and (like_count + retweet_count + quote_count + reply_count) > 4').sort_values(by=['like_count', 'retweet_count', 'quote_count', 'reply_count'], ascending=False).head(5) # TODO
-    prev_tweet_id = post_to_twitter_tweets(api_v2, prev_tweet_id, arxiv_id, top_n_tweets)
-    media_ids = []
-    html_text = generate_trans_html(title_md, authors_md, abs_md, trans_texts, summary_texts)
-    translation_media_id = upload_html_to_twitter(api_v1, f'{arxiv_id}.trans.jpg', html_text)
-    if translation_media_id:
-      api_v1.create_media_metadata(translation_media_id, strip_tweet(trans_text, 1000))
-      media_ids.append(translation_media_id)
-    text = f'{abs_md}\n{trans_text}'
+  is_news = pd.Series(dlc.is_new(df['arxiv_id'], twenty_three_hours_ago), index=df.index)
+  updated_mds = pd.to_datetime(df['updated'], utc=True).dt.strftime('%d %b %Y')
+  popular = arxiv_tweets_df[['like_count', 'retweet_count', 'quote_count', 'reply_count']].sum(axis=1) > 4
+  top_n_tweets_dict = group_top_n_tweets(arxiv_tweets_df[popular], 5)
+  empty_tweets_df = arxiv_tweets_df.head(0)
+  summary_texts_list = [segment_summary(summary, max_summary) for summary in df['summary']]
+  columns = [c.to_numpy() for c in [df['arxiv_id'], updated_mds, df['title'], pd.Series(summary_texts_list, index=df.index, dtype=object), df['authors'], df['comment'], df['primary_category'], df['categories'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count'], df['tweet_count'], is_news]]
+  # download, convert and upload first pages in background while posting tweets
+  with ThreadPoolExecutor(max_workers=4) as executor:
+    first_page_futures = {arxiv_id: executor.submit(upload_first_page_to_twitter, api_v1, arxiv_id) for arxiv_id in df['arxiv_id'][is_news][::-1]}
     try:
-      response = api_v2.create_tweet(text=strip_tweet(text, 280), user_auth=True, media_ids=media_ids if len(media_ids) > 0 else None, in_reply_to_tweet_id=prev_tweet_id)
-    except Exception as e:
-      print(e)
-    print('post_to_twitter: ', f'[{len(df)-i}/{len(df)}]')
-    time.sleep(1)
+      for i in range(len(df)-1, -1, -1):  # reverse order
+        arxiv_id, updated_md, title, summary_texts, authors, comment, primary_category, categories, like_count, retweet_count, quote_count, replay_count, tweet_count, is_new = [c[i] for c in columns]
+        # only post new papers
+        if not is_new:
+          continue
+        trans_texts, trans_ts = dlc.get(arxiv_id, None)
+        trans_text = ''.join(trans_texts)
+        summary_text = ' '.join(summary_texts)
+        new_md = '🆕' if is_new else ''
+        authors_md = ', '.join(authors)
+        categories_md = avoid_auto_link(join_categories(primary_category, categories))
+        stats_md = f'{like_count} Likes, {retweet_count} Retweets, {quote_count} Quotes, {replay_count} Replies, {tweet_count} Tweets'
+        title_md = title
+        abs_md = f'https://arxiv.org/abs/{arxiv_id}'
+        media_ids = []
+        first_page_media_id = first_page_futures[arxiv_id].result()
+        if first_page_media_id:
+          api_v1.create_media_metadata(first_page_media_id, strip_tweet(summary_text, 1000))
+          media_ids.append(first_page_media_id)
+        text = f'[{i+1}/{len(df)}] {stats_md}\n{abs_md} {categories_md}, {updated_md}\n\n{new_md}{title_md}\n\n{authors_md}'
+        prev_tweet_id = None
+        TWITTER_RATE_LIMITER.wait()
+        try:
+          response = api_v2.create_tweet(text=strip_tweet(text, 280), user_auth=True, media_ids=media_ids if len(media_ids) > 0 else None)
+          prev_tweet_id = response.data['id']
+        except Exception as e:
+          print(e)
+        top_n_tweets = top_n_tweets_dict.get(arxiv_id, empty_tweets_df)
+        prev_tweet_id = post_to_twitter_tweets(api_v2, prev_tweet_id, arxiv_id, top_n_tweets)
+        media_ids = []
+        html_text = generate_trans_html(title_md, authors_md, abs_md, trans_texts, summary_texts)
+        translation_media_id = upload_html_to_twitter(api_v1, f'{arxiv_id}.trans.jpg', html_text)
+        if translation_media_id:
+          api_v1.create_media_metadata(translation_media_id, strip_tweet(trans_text, 1000))
+          media_ids.append(translation_media_id)
+        text = f'{abs_md}\n{trans_text}'
+        TWITTER_RATE_LIMITER.wait()
+        try:
+          response = api_v2.create_tweet(text=strip_tweet(text, 280), user_auth=True, media_ids=media_ids if len(media_ids) > 0 else None, in_reply_to_tweet_id=prev_tweet_id)
+        except Exception as e:
+          print(e)
+        print('post_to_twitter: ', f'[{i+1}/{len(df)}]')
+    finally:
+      # if posting failed, skip first pages of papers which will not be tweeted
+      for future in first_page_futures.values():
+        future.cancel()
   title = f'Top {len(df)} most popular arXiv papers in the last 7 days'
   date = datetime.now(timezone.utc).strftime('%d %b %Y')
   media_ids = []
   html_text = generate_top_n_html(title, date, df, dlc)
   top_n_media_id = upload_html_to_twitter(api_v1, 'top_n.jpg', html_text)
   if top_n_media_id:
-    rev_df = df[::-1]
-    metadata = '\n'.join(map(lambda item: f'[{item[0]+1}/{len(df)}] https://arxiv.org/abs/{item[1][0]}', enumerate(zip(rev_df['arxiv_id']))))
+    metadata = '\n'.join(map(lambda item: f'[{item[0]+1}/{len(df)}] https://arxiv.org/abs/{item[1][0]}', enumerate(zip(df['arxiv_id']))))
     api_v1.create_media_metadata(top_n_media_id, strip_tweet(metadata, 1000))
     media_ids.append(top_n_media_id)
   text = title
+  TWITTER_RATE_LIMITER.wait()
   try:
     response = api_v2.create_tweet(text=strip_tweet(text, 280), user_auth=True, media_ids=media_ids if len(media_ids) > 0 else None)
   except Exception as e:
     print(e)
 
 def post_to_twitter_tweets(api_v2, prev_tweet_id, arxiv_id, df):
-  for i, (tweet_id, expanded_text, created_at, username, name, like_count, retweet_count, quote_count, replay_count) in enumerate(zip(df['id'], df['expanded_text'], df['created_at'], df['username'], df['name'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count'])):
+  created_at_mds = pd.to_datetime(df['created_at'], utc=True).dt.strftime('%d %b %Y')
+  columns = [c.to_numpy() for c in [df['id'], df['expanded_text'], created_at_mds, df['username'], df['name'], df['like_count'], df['retweet_count'], df['quote_count'], df['reply_count']]]
+  for i in range(len(df)):
+    tweet_id, expanded_text, created_at_md, username, name, like_count, retweet_count, quote_count, replay_count = [c[i] for c in columns]
     stats_md = f'{like_count} Likes, {retweet_count} Retweets, {quote_count} Quotes, {replay_count} Replies'
-    created_at_md = dateutil.parser.isoparse(created_at).strftime('%d %b %Y')
     abs_md = f'https://arxiv.org/abs/{arxiv_id}'
     url_md = f'https://twitter.com/{username}/status/{tweet_id}'
     text = f'({i+1}/{len(df)}) {stats_md}, {created_at_md}\n{abs_md}\n\n{url_md}\n'
+    TWITTER_RATE_LIMITER.wait()
     try:
       response = api_v2.create_tweet(text=strip_tweet(text, 280), user_auth=True, in_reply_to_tweet_id=prev_tweet_id)
       prev_tweet_id = response.data['id']
     except Exception as e:
       print(e)
-    time.sleep(1)
   return prev_tweet_id
 
 def summarize(tweepy_api_v2, query, since_id, page_limit):
@@ -399,7 +462,7 @@ def summarize(tweepy_api_v2, query, since_id, page_limit):
 
   # download contents of arxiv papers
   arxiv_contents = get_arxiv_contents(arxiv_ids)
-  arxiv_contents_df = pd.json_normalize(arxiv_contents)
+  arxiv_contents_df = pd.DataFrame(arxiv_contents) # arxiv_result_to_dict returns flat dicts
   print('get_arxiv_contents: ', len(arxiv_contents_df))
 
   # merge stats and contents
@@ -413,6 +476,7 @@ def main():
   page_limit = int(os.getenv('SEARCH_PAGE_LIMIT', 1))
   deepl_target_lang = 'JA'
   notify_top_n = int(os.getenv('NOTIFY_TOP_N', 5))
+  deepl_cache_max_entries = 1000 # 30 days of top 20 papers is at most 600
 
   tweepy_api_v2 = tweepy.Client(
     bearer_token=os.getenv('TWITTER_BEARER_TOKEN'),
@@ -444,15 +508,21 @@ def main():
   arxiv_tweets_dict = load_from_gcs_with_expired(
     gcs_bucket, 'arxiv_tweets_dict.json.gz', expire_timedelta=timedelta(hours=23))
   if arxiv_dict and arxiv_tweets_dict:
-    arxiv_df = pd.json_normalize(arxiv_dict)
-    arxiv_tweets_df = pd.json_normalize(arxiv_tweets_dict)
+    # records are already flat because they are saved by to_dict(orient='records')
+    arxiv_df = pd.DataFrame.from_records(arxiv_dict)
+    arxiv_tweets_df = pd.DataFrame.from_records(arxiv_tweets_dict)
   else:
     # if there is no cache or expired
     arxiv_df, arxiv_tweets_df = summarize(tweepy_api_v2, query, since_id, page_limit)
+    # posted ids belong to the previous papers. reset them before the new papers are cached,
+    # so they are never read together even if this run fails in the middle.
+    save_to_gcs(gcs_bucket, 'slack_posted_ids.json.gz', [])
     save_to_gcs(gcs_bucket, 'arxiv_dict.json.gz', arxiv_df.to_dict(orient='records'))
-    # assert arxiv_df.equals(pd.json_normalize(load_from_gcs(gcs_bucket, 'arxiv_dict.json.gz')))  # type: ignore
     save_to_gcs(gcs_bucket, 'arxiv_tweets_dict.json.gz', arxiv_tweets_df.to_dict(orient='records'))
-    # assert arxiv_tweets_df.equals(pd.json_normalize(load_from_gcs(gcs_bucket, 'arxiv_tweets_dict.json.gz'))) # type: ignore
+    if os.getenv('DEBUG_VERIFY_GCS'):
+      # this downloads and parses the caches again, so only for debugging
+      assert arxiv_df.equals(pd.DataFrame.from_records(load_from_gcs(gcs_bucket, 'arxiv_dict.json.gz')))  # type: ignore
+      assert arxiv_tweets_df.equals(pd.DataFrame.from_records(load_from_gcs(gcs_bucket, 'arxiv_tweets_dict.json.gz'))) # type: ignore
   print('main: ', len(arxiv_df), len(arxiv_tweets_df))
 
   # pickup top N papers
@@ -461,15 +531,25 @@ def main():
   # translate summary text
   dlc = deeplcache.DeepLCache(deepl_api)  # type: ignore
   try:
-    dlc.load_from_gcs(gcs_bucket, 'deepl_cache.json.gz')
+    try:
+      dlc.load_from_gcs_msgpack(gcs_bucket, 'deepl_cache.msgpack.zst')
+    except NotFound:
+      # only the first run after switching to msgpack reads the old format.
+      # TODO: remove this fallback once deepl_cache.msgpack.zst is in the bucket
+      # (entries in deepl_cache.json.gz expire after 30 days anyway).
+      dlc.load_from_gcs(gcs_bucket, 'deepl_cache.json.gz')
   except Exception as e:
     print(e)
   dlc = translate_arxiv(dlc, arxiv_df_top_n, deepl_target_lang, 2000) # TODO
-  dlc.clear_cache(expire_timedelta=timedelta(days=30))
-  dlc.save_to_gcs(gcs_bucket, 'deepl_cache.json.gz')
+  dlc.clear_cache(expire_timedelta=timedelta(days=30), max_entries=deepl_cache_max_entries)
+  dlc.save_to_gcs_msgpack(gcs_bucket, 'deepl_cache.msgpack.zst')
 
-  # post to Slack
-  post_to_slack(slack_api, slack_channel, arxiv_df_top_n, arxiv_tweets_df, dlc, 2000) # TODO
+  # post to Slack. skip papers already posted by a previous run on the same cached papers
+  slack_posted_ids = set(load_from_gcs(gcs_bucket, 'slack_posted_ids.json.gz') or [])
+  try:
+    post_to_slack(slack_api, slack_channel, arxiv_df_top_n, arxiv_tweets_df, dlc, 2000, slack_posted_ids) # TODO
+  finally:
+    save_to_gcs(gcs_bucket, 'slack_posted_ids.json.gz', list(slack_posted_ids))
 
   # post to Twitter. it needs api v1 because media_upload is only available on api v1.
   post_to_twitter(tweepy_api_v1, tweepy_api_v2, arxiv_df_top_n, arxiv_tweets_df, dlc, 2000) # TODO
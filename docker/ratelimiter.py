@@ -0,0 +1,28 @@
+# SPDX-FileCopyrightText: 2023 Susumu OTA <1632335+susumuota@users.noreply.github.com>
+#
+# SPDX-License-Identifier: MIT
+
+import threading
+import time
+
+class RateLimiter:
+  """token bucket. allow `rate` calls per `per` seconds.
+  wait() only sleeps when calls are actually faster than the rate."""
+  def __init__(self, rate, per=1.0):
+    self.capacity = rate
+    self.fill_rate = rate / per
+    self.tokens = rate
+    self.last = time.monotonic()
+    self.lock = threading.Lock()
+
+  def wait(self):
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.fill_rate)
+      self.last = now
+      if self.tokens < 1:
+        delay = (1 - self.tokens) / self.fill_rate
+        time.sleep(delay)
+        self.last = now + delay
+        self.tokens = 1
+      self.tokens -= 1
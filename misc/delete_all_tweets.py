@@ -2,28 +2,45 @@
 #
 # SPDX-License-Identifier: MIT
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from math import inf
 import os
+import threading
+import time
 
 import tweepy
 
 
+class WindowLimiter:
+  """at most `rate` calls start in any `per` seconds window. the first `rate` calls start right away.
+  docker/ratelimiter.py is a token bucket, which can let up to twice `rate` through a fixed window"""
+  def __init__(self, rate, per):
+    self.per = per
+    self.starts = deque(maxlen=rate) # start times of the last `rate` calls
+    self.lock = threading.Lock()
+
+  def wait(self):
+    with self.lock:
+      if len(self.starts) == self.starts.maxlen:
+        delay = self.starts[0] + self.per - time.monotonic()
+        if delay > 0:
+          time.sleep(delay)
+      self.starts.append(time.monotonic())
+
+
 def get_my_user_id(api_v2):
   return api_v2.get_me().data.id
 
 def get_oldest_tweet_ids(api_v2, user_id, max_results=100):
-  oldest_tweets = []
+  oldest_tweets = deque(maxlen=max_results) # keeps only the last max_results ids
   total_count = 0
   for response in tweepy.Paginator(api_v2.get_users_tweets, id=user_id, max_results=100, limit=inf, user_auth=True):
     if not (response and response.data and 'result_count' in response.meta and response.meta['result_count'] > 0):  # type: ignore
       break
     total_count += response.meta['result_count']  # type: ignore
-    for tweet in response.data:  # type: ignore
-      oldest_tweets.append(tweet.id)
-    oldest_tweets = oldest_tweets[-max_results:]
-    assert len(oldest_tweets) <= max_results
-  oldest_tweets.reverse()
-  return oldest_tweets, total_count
+    oldest_tweets.extend(tweet.id for tweet in response.data)  # type: ignore
+  return list(reversed(oldest_tweets)), total_count
 
 def delete_all_tweets(api_v2, user_id):
   '''
@@ -31,6 +48,12 @@ def delete_all_tweets(api_v2, user_id):
   User rate limit (User context): 50 requests per 15-minute window per each authenticated user
   '''
 
+  limiter = WindowLimiter(50, per=15*60)
+  def delete_tweet(tweet_id):
+    limiter.wait()
+    print(f'Deleting a tweet (id: {tweet_id})...', flush=True)
+    return api_v2.delete_tweet(tweet_id, user_auth=True)
+
   delete_count = 0
   try:
     while True:
@@ -41,14 +64,14 @@ def delete_all_tweets(api_v2, user_id):
       if len(tweet_ids) == 0:
         break
       print(f'It might take {(total_count // 50 + 1) * 15} minutes to delete all of the tweets because of rate limit (50 requests per 15-minute).')
-      for tweet_id in tweet_ids:
-        print(f'Deleting a tweet (id: {tweet_id})...', flush=True)
-        response = api_v2.delete_tweet(tweet_id, user_auth=True)
-        if response and response.data and 'deleted' in response.data and response.data['deleted']:
-          delete_count += 1
-          print(f'Deleting a tweet (id: {tweet_id})...done')
-        else:
-          print(f'Error: {response}')
+      # overlap round trips of a few requests. the limiter keeps them under the rate limit.
+      with ThreadPoolExecutor(max_workers=4) as executor:
+        for tweet_id, response in zip(tweet_ids, executor.map(delete_tweet, tweet_ids)):
+          if response and response.data and 'deleted' in response.data and response.data['deleted']:
+            delete_count += 1
+            print(f'Deleting a tweet (id: {tweet_id})...done')
+          else:
+            print(f'Error: {response}')
   finally:
     print(f'Deleted {delete_count} tweets.')
 